@@ -1,9 +1,14 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
 from flask import Flask, render_template, request, redirect, session, url_for, jsonify, flash
 import sqlite3
 import os
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 import hashlib
+from inventory import init_reservations, available_stock, can_check_out, renew_holds, stock_metrics
+from startup import TemplateCache, record_import, install_request_timing, boot, state as startup_state
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'
@@ -15,8 +20,11 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2MB limit
 
-# Create upload folder if not exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Compiled templates are cached on disk and shared between workers
+app.config['TEMPLATE_CACHE_FOLDER'] = os.environ.get('TEMPLATE_CACHE_FOLDER', '.jinja_cache')
+app.jinja_options = {**app.jinja_options, 'bytecode_cache': TemplateCache(app.config['TEMPLATE_CACHE_FOLDER'])}
+# Boot on the first request when the entrypoint didn't, set LAZY_BOOT=0 to disable
+app.config['LAZY_BOOT'] = os.environ.get('LAZY_BOOT', '1') != '0'
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -83,6 +91,7 @@ def init_db():
                         quantity INTEGER DEFAULT 1,
                         added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )''')
+        init_reservations(con)
         
         # Insert default admin
         try:
@@ -103,6 +112,19 @@ def init_db():
             print(f"Error initializing database: {str(e)}")
             con.rollback()
 
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@app.route('/readyz')
+def readyz():
+    body = {
+        'ready': startup_state['ready'],
+        'error': startup_state['error'],
+        'timings': startup_state['timings']
+    }
+    return jsonify(body), (200 if startup_state['ready'] else 503)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -171,20 +193,23 @@ def add_to_cart(product_id):
         return redirect('/login')
     
     with sqlite3.connect(DATABASE) as con:
-        stock = con.execute("SELECT stock FROM products WHERE id=?", 
-                           (product_id,)).fetchone()
-        if not stock or stock[0] <= 0:
+        # Take the write lock first so no other worker can reserve between the check and the hold
+        con.execute("BEGIN IMMEDIATE")
+        available = available_stock(con, product_id, exclude_user=session['user'])
+        existing = con.execute("SELECT * FROM cart WHERE username=? AND product_id=?", 
+                             (session['user'], product_id)).fetchone()
+        in_cart = existing[3] if existing else 0
+        if available is None or in_cart >= available:
             flash("Product out of stock", 'error')
             return redirect('/products')
         
-        existing = con.execute("SELECT * FROM cart WHERE username=? AND product_id=?", 
-                             (session['user'], product_id)).fetchone()
         if existing:
             con.execute("UPDATE cart SET quantity = quantity + 1 WHERE id=?", 
                        (existing[0],))
         else:
             con.execute("INSERT INTO cart (username, product_id) VALUES (?, ?)", 
                        (session['user'], product_id))
+        renew_holds(con, session['user'])
         con.commit()
     
     flash("Product added to cart", 'success')
@@ -196,6 +221,7 @@ def update_cart(product_id, action):
         return jsonify({'success': False, 'error': 'Not logged in'})
     
     with sqlite3.connect(DATABASE) as con:
+        con.execute("BEGIN IMMEDIATE")
         item = con.execute("SELECT quantity FROM cart WHERE username=? AND product_id=?", 
                           (session['user'], product_id)).fetchone()
         
@@ -204,9 +230,8 @@ def update_cart(product_id, action):
         
         new_quantity = item[0]
         if action == 'increase':
-            stock = con.execute("SELECT stock FROM products WHERE id=?", 
-                              (product_id,)).fetchone()[0]
-            if new_quantity >= stock:
+            available = available_stock(con, product_id, exclude_user=session['user'])
+            if available is None or new_quantity >= available:
                 return jsonify({'success': False, 'error': 'Not enough stock'})
             new_quantity += 1
         elif action == 'decrease' and item[0] > 1:
@@ -214,6 +239,7 @@ def update_cart(product_id, action):
         
         con.execute("UPDATE cart SET quantity=? WHERE username=? AND product_id=?", 
                    (new_quantity, session['user'], product_id))
+        renew_holds(con, session['user'])
         
         cart_items = con.execute('''SELECT p.id, p.name, p.price, c.quantity 
                                   FROM products p JOIN cart c ON p.id = c.product_id 
@@ -279,11 +305,16 @@ def checkout():
                 flash("Your cart is empty", 'error')
                 return redirect('/products')
             
+            # Filling in the form shouldn't let the sweeper release the cart
+            renew_holds(con, session['user'])
+            con.commit()
+            
             total = sum(item[2] * item[3] for item in cart_items)
             delivery_charge = 30
             grand_total = total + delivery_charge
             
-            out_of_stock = any(item[3] > item[4] for item in cart_items)
+            out_of_stock = any(not can_check_out(con, item[0], session['user'], item[3])
+                               for item in cart_items)
             if out_of_stock:
                 flash("Some items in your cart are out of stock", 'error')
                 return redirect('/view_cart')
@@ -306,6 +337,7 @@ def checkout():
         
         with sqlite3.connect(DATABASE) as con:
             try:
+                con.execute("BEGIN IMMEDIATE")
                 cart_items = con.execute('''SELECT p.id, p.name, p.price, c.quantity, p.stock
                                           FROM products p JOIN cart c ON p.id = c.product_id
                                           WHERE c.username=?''', (session['user'],)).fetchall()
@@ -319,7 +351,8 @@ def checkout():
                 for item in cart_items:
                     product_id, name, price, quantity, stock = item
                     
-                    if quantity > stock:
+                    if not can_check_out(con, product_id, session['user'], quantity):
+                        con.rollback()
                         flash(f"Not enough stock for {name}", 'error')
                         return redirect('/view_cart')
                     
@@ -623,6 +656,15 @@ def delete_product(product_id):
     flash("Product deleted successfully", 'success')
     return redirect('/admin_dashboard')
 
+@app.route('/admin_stock_metrics')
+def admin_stock_metrics():
+    if 'admin' not in session:
+        return jsonify({'success': False, 'error': 'Not logged in'})
+    
+    with sqlite3.connect(DATABASE) as con:
+        metrics = stock_metrics(con)
+    return jsonify(metrics)
+
 @app.route('/update_order_status/<int:order_id>', methods=['POST'])
 def update_order_status(order_id):
     if 'admin' not in session:
@@ -670,7 +712,10 @@ def logout():
     session.clear()
     return redirect('/')
 
+install_request_timing(app, DATABASE, init_db)
+record_import(IMPORT_STARTED)
+
 if __name__ == '__main__':
-    if not os.path.exists(DATABASE):
-        init_db()
+    # The debug reloader runs this twice, only its child process serves requests
+    boot(app, DATABASE, init_db, sweeper=os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
     app.run(debug=True)
@@ -0,0 +1,152 @@
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# How long a cart row holds stock before the sweeper releases it
+CART_HOLD_MINUTES = 15
+# Rows deleted per statement by the sweeper, keeps each write lock short
+SWEEP_BATCH_SIZE = 5000
+SWEEP_INTERVAL_SECONDS = 60
+# Lock file next to the database, held by the one process allowed to sweep
+SWEEPER_LOCK_SUFFIX = '.sweeper.lock'
+
+
+def _hold_cutoff(hold_minutes):
+    return f'-{int(hold_minutes)} minutes'
+
+
+def init_reservations(con):
+    # The sweeper and the reserved-stock sums both filter on added_at
+    con.execute("CREATE INDEX IF NOT EXISTS idx_cart_added_at ON cart (added_at)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_cart_product ON cart (product_id, added_at)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_cart_user_product ON cart (username, product_id)")
+    con.commit()
+
+
+def reserved_stock(con, product_id, exclude_user=None, hold_minutes=CART_HOLD_MINUTES):
+    """Quantity of a product held by live cart rows, optionally ignoring one user's own holds."""
+    query = '''SELECT COALESCE(SUM(quantity), 0) FROM cart
+               WHERE product_id=? AND added_at >= datetime('now', ?)'''
+    params = [product_id, _hold_cutoff(hold_minutes)]
+    if exclude_user is not None:
+        query += " AND username != ?"
+        params.append(exclude_user)
+    return con.execute(query, params).fetchone()[0]
+
+
+def available_stock(con, product_id, exclude_user=None, hold_minutes=CART_HOLD_MINUTES):
+    """Stock left after live holds, or None if the product does not exist."""
+    row = con.execute("SELECT stock FROM products WHERE id=?", (product_id,)).fetchone()
+    if not row:
+        return None
+    return row[0] - reserved_stock(con, product_id, exclude_user, hold_minutes)
+
+
+def can_check_out(con, product_id, username, quantity, hold_minutes=CART_HOLD_MINUTES):
+    """Whether this user's cart quantity of a product can be ordered now.
+
+    Only live holds on cart rows older than this user's own count against it,
+    ranked by cart id since renewing a hold rewrites added_at. That way holds
+    adding up to more than the stock never block every holder at once. A user
+    whose own hold is still live may order whenever the stock covers it.
+    """
+    stock = con.execute("SELECT stock FROM products WHERE id=?", (product_id,)).fetchone()
+    own = con.execute('''SELECT MIN(id), MAX(added_at >= datetime('now', ?)) FROM cart
+                         WHERE username=? AND product_id=?''',
+                      (_hold_cutoff(hold_minutes), username, product_id)).fetchone()
+    if not stock or own[0] is None:
+        return False
+    if own[1] and quantity <= stock[0]:
+        return True
+    ahead = con.execute('''SELECT COALESCE(SUM(quantity), 0) FROM cart
+                           WHERE product_id=? AND id < ? AND username != ?
+                           AND added_at >= datetime('now', ?)''',
+                        (product_id, own[0], username, _hold_cutoff(hold_minutes))).fetchone()[0]
+    return quantity <= stock[0] - ahead
+
+
+def renew_holds(con, username):
+    # Any cart activity extends the hold on everything in that user's cart
+    con.execute("UPDATE cart SET added_at = CURRENT_TIMESTAMP WHERE username=?", (username,))
+
+
+def stock_metrics(con, hold_minutes=CART_HOLD_MINUTES):
+    rows = con.execute('''SELECT p.id, p.name, p.stock, COALESCE(SUM(c.quantity), 0)
+                          FROM products p
+                          LEFT JOIN cart c ON c.product_id = p.id
+                               AND c.added_at >= datetime('now', ?)
+                          GROUP BY p.id
+                          ORDER BY p.id''', (_hold_cutoff(hold_minutes),)).fetchall()
+    products = [{
+        'id': product_id,
+        'name': name,
+        'stock': stock,
+        'reserved': reserved,
+        'available': max(stock - reserved, 0)
+    } for product_id, name, stock, reserved in rows]
+    expired_rows = con.execute("SELECT COUNT(*) FROM cart WHERE added_at < datetime('now', ?)",
+                               (_hold_cutoff(hold_minutes),)).fetchone()[0]
+    return {
+        'total_stock': sum(p['stock'] for p in products),
+        'total_reserved': sum(p['reserved'] for p in products),
+        'total_available': sum(p['available'] for p in products),
+        'expired_cart_rows': expired_rows,
+        'products': products
+    }
+
+
+def sweep_expired_carts(database, hold_minutes=CART_HOLD_MINUTES, batch_size=SWEEP_BATCH_SIZE):
+    """Delete expired cart rows in batches, committing after each one. Returns rows deleted."""
+    deleted = 0
+    with sqlite3.connect(database) as con:
+        while True:
+            cur = con.execute('''DELETE FROM cart WHERE id IN (
+                                     SELECT id FROM cart
+                                     WHERE added_at < datetime('now', ?)
+                                     LIMIT ?)''', (_hold_cutoff(hold_minutes), batch_size))
+            con.commit()
+            deleted += cur.rowcount
+            if cur.rowcount < batch_size:
+                break
+    return deleted
+
+
+def _try_lock(lock_file):
+    try:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def start_cart_sweeper(database, interval=SWEEP_INTERVAL_SECONDS):
+    """Start the sweeper thread for this process.
+
+    Every worker starts one, but only the process holding the lock file sweeps.
+    The others keep retrying the lock so sweeping resumes if that process exits.
+    """
+    lock_file = open(database + SWEEPER_LOCK_SUFFIX, 'w')
+
+    def run():
+        locked = False
+        while True:
+            locked = locked or _try_lock(lock_file)
+            if locked:
+                try:
+                    sweep_expired_carts(database)
+                except sqlite3.Error as e:
+                    print(f"Error sweeping expired carts: {str(e)}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='cart-sweeper', daemon=True)
+    thread.start()
+    return thread
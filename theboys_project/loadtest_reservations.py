@@ -0,0 +1,284 @@
+"""Load test for cart reservations and the expired cart sweeper.
+
+Runs against a throwaway SQLite database, not grocery.db:
+
+    python loadtest_reservations.py --cart-rows 2000000 --shoppers 5000
+
+The cart table is seeded with --cart-rows rows first, a --live-fraction of
+them inside the hold window. Each product gets enough stock to cover its
+seeded live holds plus --stock more for the shoppers to compete over.
+Checkout is then run for every live cart, seeded and shopper, with and
+without holds, against the full table.
+
+The holds rounds run one shopper at a time. The concurrent rounds spread
+shoppers over --workers processes, once taking the write lock before the
+stock check as the app does, and once without it, to show how many units
+the race over-reserves.
+
+Not covered: holds that have expired but not been swept yet, and stock
+that an admin drops below the reserved total mid-round.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from inventory import CART_HOLD_MINUTES, init_reservations, available_stock, can_check_out, sweep_expired_carts
+
+
+def create_schema(con):
+    con.execute('''CREATE TABLE products (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT,
+                    price REAL,
+                    stock INTEGER DEFAULT 100
+                )''')
+    con.execute('''CREATE TABLE cart (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT,
+                    product_id INTEGER,
+                    quantity INTEGER DEFAULT 1,
+                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )''')
+    init_reservations(con)
+
+
+def seed_products(con, products):
+    con.executemany("INSERT INTO products (id, name, price, stock) VALUES (?, ?, ?, 0)",
+                    [(i, f"Product {i}", 10) for i in range(1, products + 1)])
+    con.commit()
+
+
+def seed_carts(con, rows, products, live_fraction):
+    """Insert cart rows, of which live_fraction are inside the hold window."""
+    batch = []
+    for i in range(rows):
+        if random.random() < live_fraction:
+            minutes = random.randint(0, CART_HOLD_MINUTES - 2)
+        else:
+            minutes = random.randint(CART_HOLD_MINUTES + 1, 60 * 24 * 30)
+        batch.append((f"seed{i}", random.randint(1, products), f'-{minutes} minutes'))
+        if len(batch) == 50000:
+            con.executemany("INSERT INTO cart (username, product_id, added_at) VALUES (?, ?, datetime('now', ?))",
+                            batch)
+            batch = []
+    if batch:
+        con.executemany("INSERT INTO cart (username, product_id, added_at) VALUES (?, ?, datetime('now', ?))",
+                        batch)
+    con.commit()
+
+
+def live_carts(con):
+    return con.execute('''SELECT username, product_id, quantity, added_at FROM cart
+                          WHERE added_at >= datetime('now', ?)''',
+                       (f'-{CART_HOLD_MINUTES} minutes',)).fetchall()
+
+
+def reset_round(con, live_rows, stock):
+    """Put back the seeded live carts and stock a previous round checked out."""
+    con.execute("DELETE FROM cart WHERE added_at >= datetime('now', ?)", (f'-{CART_HOLD_MINUTES} minutes',))
+    con.executemany("INSERT INTO cart (username, product_id, quantity, added_at) VALUES (?, ?, ?, ?)",
+                    live_rows)
+    con.executemany("UPDATE products SET stock=? WHERE id=?",
+                    [(amount, product_id) for product_id, amount in stock.items()])
+    con.commit()
+
+
+def timed(latencies, fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    latencies.append((time.perf_counter() - started) * 1000)
+    return result
+
+
+def raw_stock(con, product_id):
+    return con.execute("SELECT stock FROM products WHERE id=?", (product_id,)).fetchone()[0]
+
+
+def run_round(con, shoppers, products, with_holds):
+    """Shoppers add one random product each, then every live cart checks out.
+
+    With holds, add-to-cart and checkout use the same locked available_stock
+    and can_check_out checks as app.add_to_cart and app.checkout. Without
+    holds they check raw stock, as the app did before reservations.
+    """
+    add_latencies = []
+    checkout_latencies = []
+
+    rejected = 0
+    for i in range(shoppers):
+        username = f"shopper{i}"
+        product_id = random.randint(1, products)
+        if with_holds:
+            con.execute("BEGIN IMMEDIATE")
+            available = timed(add_latencies, available_stock, con, product_id, exclude_user=username)
+        else:
+            available = timed(add_latencies, raw_stock, con, product_id)
+        if available < 1:
+            rejected += 1
+        else:
+            con.execute("INSERT INTO cart (username, product_id) VALUES (?, ?)", (username, product_id))
+        con.commit()
+
+    failed = {'seed': 0, 'shopper': 0}
+    attempted = {'seed': 0, 'shopper': 0}
+    carts = live_carts(con)
+    random.shuffle(carts)
+    for username, product_id, quantity, _ in carts:
+        kind = 'shopper' if username.startswith('shopper') else 'seed'
+        attempted[kind] += 1
+        if with_holds:
+            con.execute("BEGIN IMMEDIATE")
+            allowed = timed(checkout_latencies, can_check_out, con, product_id, username, quantity)
+        else:
+            allowed = quantity <= timed(checkout_latencies, raw_stock, con, product_id)
+        if not allowed:
+            failed[kind] += 1
+            con.rollback()
+            continue
+        con.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (quantity, product_id))
+        con.execute("DELETE FROM cart WHERE username = ?", (username,))
+        con.commit()
+    return rejected, attempted, failed, add_latencies, checkout_latencies
+
+
+def _race_add(job):
+    database, picks, locked = job
+    rejected = 0
+    with sqlite3.connect(database, timeout=60) as con:
+        for username, product_id in picks:
+            if locked:
+                con.execute("BEGIN IMMEDIATE")
+            if available_stock(con, product_id, exclude_user=username) < 1:
+                rejected += 1
+            else:
+                con.execute("INSERT INTO cart (username, product_id) VALUES (?, ?)", (username, product_id))
+            con.commit()
+    return rejected
+
+
+def _race_checkout(job):
+    database, usernames = job
+    attempted = failed = 0
+    with sqlite3.connect(database, timeout=60) as con:
+        for username in usernames:
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute("SELECT product_id, quantity FROM cart WHERE username=?", (username,)).fetchone()
+            if not row:
+                con.rollback()
+                continue
+            attempted += 1
+            if not can_check_out(con, row[0], username, row[1]):
+                failed += 1
+                con.rollback()
+                continue
+            con.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (row[1], row[0]))
+            con.execute("DELETE FROM cart WHERE username = ?", (username,))
+            con.commit()
+    return attempted, failed
+
+
+def over_reserved(con):
+    """Units held by live carts beyond what the product has in stock."""
+    return con.execute('''SELECT COALESCE(SUM(held - stock), 0) FROM (
+                              SELECT p.stock AS stock, SUM(c.quantity) AS held
+                              FROM products p JOIN cart c ON c.product_id = p.id
+                              WHERE c.added_at >= datetime('now', ?)
+                              GROUP BY p.id)
+                          WHERE held > stock''', (f'-{CART_HOLD_MINUTES} minutes',)).fetchone()[0]
+
+
+def run_concurrent_round(con, database, shoppers, products, workers, locked):
+    """Shoppers add to cart from several processes at once, then every live cart checks out the same way."""
+    picks = [(f"racer{i}", random.randint(1, products)) for i in range(shoppers)]
+    with multiprocessing.Pool(workers) as pool:
+        rejected = sum(pool.map(_race_add, [(database, picks[w::workers], locked) for w in range(workers)]))
+        over = over_reserved(con)
+        usernames = [row[0] for row in live_carts(con)]
+        random.shuffle(usernames)
+        results = pool.map(_race_checkout, [(database, usernames[w::workers]) for w in range(workers)])
+    attempted = sum(r[0] for r in results)
+    failed = sum(r[1] for r in results)
+    return rejected, over, attempted, failed
+
+
+def latency_summary(latencies):
+    if not latencies:
+        return "n/a"
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"median {statistics.median(ordered):.3f}ms, p95 {p95:.3f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cart-rows', type=int, default=1000000)
+    parser.add_argument('--live-fraction', type=float, default=0.001)
+    parser.add_argument('--products', type=int, default=50)
+    parser.add_argument('--stock', type=int, default=20)
+    parser.add_argument('--shoppers', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    fd, database = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        with sqlite3.connect(database) as con:
+            create_schema(con)
+            seed_products(con, args.products)
+
+            start = time.perf_counter()
+            seed_carts(con, args.cart_rows, args.products, args.live_fraction)
+            print(f"Seeded {args.cart_rows} cart rows in {time.perf_counter() - start:.1f}s")
+
+            live_rows = live_carts(con)
+            stock = {i: args.stock for i in range(1, args.products + 1)}
+            for _, product_id, quantity, _ in live_rows:
+                stock[product_id] += quantity
+            print(f"{len(live_rows)} seeded live holds, {args.shoppers} shoppers, "
+                  f"{args.products} products x {args.stock} unreserved stock")
+
+            for with_holds in (False, True):
+                reset_round(con, live_rows, stock)
+                rejected, attempted, failed, add_latencies, checkout_latencies = run_round(
+                    con, args.shoppers, args.products, with_holds)
+                total_attempted = sum(attempted.values())
+                total_failed = sum(failed.values())
+                rate = total_failed / total_attempted if total_attempted else 0
+                print(f"  {'with holds' if with_holds else 'no holds'}:")
+                print(f"    {rejected} shoppers rejected at add, stock check {latency_summary(add_latencies)}")
+                print(f"    {total_failed}/{total_attempted} checkouts failed ({rate:.1%}): "
+                      f"{failed['seed']}/{attempted['seed']} seeded, "
+                      f"{failed['shopper']}/{attempted['shopper']} shoppers")
+                print(f"    checkout stock check {latency_summary(checkout_latencies)}")
+
+            for locked in (False, True):
+                reset_round(con, live_rows, stock)
+                rejected, over, attempted, failed = run_concurrent_round(
+                    con, database, args.shoppers, args.products, args.workers, locked)
+                rate = failed / attempted if attempted else 0
+                print(f"  {args.workers} processes, {'locked' if locked else 'unlocked'} add-to-cart:")
+                print(f"    {rejected} shoppers rejected at add, {over} units over-reserved")
+                print(f"    {failed}/{attempted} checkouts failed ({rate:.1%})")
+
+        start = time.perf_counter()
+        deleted = sweep_expired_carts(database, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - start
+        batches = -(-deleted // args.batch_size) if deleted else 0
+        print(f"Sweeper deleted {deleted} rows in {batches} batches, {elapsed:.2f}s "
+              f"({elapsed / max(batches, 1) * 1000:.1f}ms per batch)")
+
+        start = time.perf_counter()
+        deleted = sweep_expired_carts(database, batch_size=args.batch_size)
+        print(f"Idle sweep ({deleted} rows): {(time.perf_counter() - start) * 1000:.2f}ms")
+    finally:
+        os.remove(database)
+
+
+if __name__ == '__main__':
+    main()
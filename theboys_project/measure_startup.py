@@ -0,0 +1,71 @@
+"""Measure worker import time, time-to-first-request and first request latency.
+
+Each run starts a fresh interpreter, the same as a new worker. Warm runs boot
+first and share one template cache, so only the first of them compiles.
+--no-warmup runs skip boot entirely, with lazy boot off and an empty
+template cache each, so the first request pays the full cold cost:
+
+    python measure_startup.py --workers 5
+    python measure_startup.py --workers 5 --no-warmup
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+WORKER = """
+import json, sys, time
+from app import app, DATABASE, init_db
+from startup import boot, state
+if sys.argv[1] == 'warm':
+    boot(app, DATABASE, init_db, sweeper=False)
+client = app.test_client()
+with client.session_transaction() as sess:
+    sess['user'] = 'loadtest'
+client.get(sys.argv[2])
+print(json.dumps(state['timings']))
+"""
+
+
+def run_worker(warm, path, cache_folder):
+    env = dict(os.environ, TEMPLATE_CACHE_FOLDER=cache_folder, LAZY_BOOT='1' if warm else '0')
+    output = subprocess.run([sys.executable, '-c', WORKER, 'warm' if warm else 'cold', path],
+                            env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=5)
+    parser.add_argument('--path', default='/products')
+    parser.add_argument('--no-warmup', action='store_true')
+    args = parser.parse_args()
+
+    shared_cache = tempfile.mkdtemp(prefix='jinja_cache_')
+    runs = []
+    try:
+        for _ in range(args.workers):
+            if args.no_warmup:
+                cache_folder = tempfile.mkdtemp(prefix='jinja_cache_')
+                try:
+                    runs.append(run_worker(False, args.path, cache_folder))
+                finally:
+                    shutil.rmtree(cache_folder, ignore_errors=True)
+            else:
+                runs.append(run_worker(True, args.path, shared_cache))
+    finally:
+        shutil.rmtree(shared_cache, ignore_errors=True)
+    for i, timings in enumerate(runs, 1):
+        print(f"worker {i}: {timings}")
+    for key in ('import_ms', 'boot_ms', 'time_to_first_request_ms', 'first_request_ms'):
+        values = [run[key] for run in runs if key in run]
+        if values:
+            print(f"{key}: median {statistics.median(values):.2f}, max {max(values):.2f}")
+
+
+if __name__ == '__main__':
+    main()
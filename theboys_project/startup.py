@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import threading
+import time
+
+from flask import g, request
+from jinja2 import FileSystemBytecodeCache
+
+from inventory import init_reservations, start_cart_sweeper
+
+REQUIRED_TABLES = {'users', 'admins', 'products', 'orders', 'cart'}
+# Requests that don't count towards first request timings
+UNTIMED_ENDPOINTS = ('healthz', 'readyz', 'static')
+# Read size used to pull the database file into the OS page cache
+WARM_CHUNK_SIZE = 1024 * 1024
+
+_boot_lock = threading.Lock()
+state = {
+    'pid': None,
+    'ready': False,
+    'booting': False,
+    'error': None,
+    'timings': {}
+}
+
+
+class TemplateCache(FileSystemBytecodeCache):
+    """Bytecode cache shared by every worker, so templates are only compiled once per deploy.
+
+    The folder is created by boot, until then compiled templates just aren't written out.
+    """
+
+    def dump_bytecode(self, bucket):
+        if os.path.isdir(self.directory):
+            super().dump_bytecode(bucket)
+
+
+def record_import(started):
+    state['process_started'] = started
+    state['timings']['import_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+
+def precompile_templates(app):
+    compiled = 0
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except Exception as e:
+            print(f"Error compiling template {name}: {str(e)}")
+    return compiled
+
+
+def check_schema(database, init_db):
+    with sqlite3.connect(database) as con:
+        tables = {row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    if not REQUIRED_TABLES <= tables:
+        init_db()
+    with sqlite3.connect(database) as con:
+        init_reservations(con)
+
+
+def warm_database(database):
+    # Reading the file once puts its pages in the OS cache before the first query needs them
+    with open(database, 'rb') as f:
+        while f.read(WARM_CHUNK_SIZE):
+            pass
+    with sqlite3.connect(database) as con:
+        for table in sorted(REQUIRED_TABLES):
+            con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+
+
+def boot(app, database, init_db, sweeper=True):
+    """Run the one-off startup work for this worker and mark it ready."""
+    with _boot_lock:
+        if state['ready']:
+            return
+        state['booting'] = True
+        # Looked up here rather than at import, so it is the worker's pid and not its parent's
+        state['pid'] = os.getpid()
+        timings = state['timings']
+        started = time.perf_counter()
+        try:
+            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+            os.makedirs(app.config['TEMPLATE_CACHE_FOLDER'], exist_ok=True)
+
+            step = time.perf_counter()
+            check_schema(database, init_db)
+            timings['schema_ms'] = round((time.perf_counter() - step) * 1000, 2)
+
+            step = time.perf_counter()
+            warm_database(database)
+            timings['db_warm_ms'] = round((time.perf_counter() - step) * 1000, 2)
+
+            step = time.perf_counter()
+            state['templates'] = precompile_templates(app)
+            timings['templates_ms'] = round((time.perf_counter() - step) * 1000, 2)
+
+            if sweeper:
+                start_cart_sweeper(database)
+            timings['boot_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            state['ready'] = True
+            print(f"Worker {state['pid']} ready: {timings}")
+        except Exception as e:
+            state['error'] = str(e)
+            print(f"Error booting worker {state['pid']}: {str(e)}")
+        finally:
+            state['booting'] = False
+
+
+def start_boot(app, database, init_db):
+    if state['ready'] or state['booting']:
+        return None
+    state['booting'] = True
+    thread = threading.Thread(target=boot, args=(app, database, init_db), name='boot', daemon=True)
+    thread.start()
+    return thread
+
+
+def install_request_timing(app, database, init_db):
+    """Boot lazily if no entrypoint did, and record the first real request this worker serves."""
+    @app.before_request
+    def _before_request():
+        if app.config['LAZY_BOOT'] and not state['ready'] and not state['booting'] and not state['error']:
+            start_boot(app, database, init_db)
+        if request.endpoint in UNTIMED_ENDPOINTS:
+            return
+        if 'first_request_ms' not in state['timings']:
+            g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _after_request(response):
+        started = g.pop('request_started', None)
+        timings = state['timings']
+        if started is not None and 'first_request_ms' not in timings:
+            timings['first_request_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            if 'process_started' in state:
+                timings['time_to_first_request_ms'] = round((started - state['process_started']) * 1000, 2)
+            print(f"Worker {os.getpid()} first request: {timings}")
+        return response
@@ -0,0 +1,13 @@
+"""WSGI entrypoint for production servers, e.g. ``gunicorn -w 4 wsgi:app``.
+
+Each worker starts its boot phase in the background as soon as it is
+imported, so /healthz answers straight away and /readyz turns 200 once
+the schema check and warmup are done.
+
+gunicorn --preload is not supported: the app would be imported once in the
+master, so boot and the sweeper would run there and not in the workers.
+"""
+from app import app, DATABASE, init_db
+from startup import start_boot
+
+start_boot(app, DATABASE, init_db)